@@ -0,0 +1,297 @@
+import os
+import sys
+import logging
+import asyncio
+import shutil
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.ext import CallbackContext, InvalidCallbackData
+from telegram.error import TelegramError
+from cachetools import TTLCache
+from helpers import (
+    EXTRACT_POOL,
+    LOCAL_BOT_API_URL,
+    MAX_FILE_SIZE,
+    SEND_BY_URL_LIMIT,
+    UPLOAD_CONCURRENCY,
+    CHUNK_DURATION,
+    run_in_pool,
+    extract_video_info,
+    normalize_url,
+    get_video_formats,
+    download_cookie_file,
+    find_format,
+    is_streamable,
+    is_seekable_url,
+    ffmpeg_header_args,
+    remove_file,
+    new_chunk_dir,
+    acquire_download,
+    release_download,
+    probe_duration,
+    probe_keyframes,
+    even_cuts,
+    keyframe_cuts,
+    chunk_duration_for,
+    split_file,
+    split_stream,
+    write_info_json,
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram file_ids of videos we've already uploaded (one per part), keyed by (url, format_id);
+# sending a file_id again makes Telegram reuse its stored copy. Expires since what a URL
+# points at can change.
+file_id_cache = TTLCache(maxsize=4096, ttl=24 * 60 * 60)
+
+# Recently extracted video info, so picking a quality (or re-sending a link) doesn't extract again.
+# Only touched from the event loop; TTLCache isn't thread-safe.
+info_cache = TTLCache(maxsize=512, ttl=300)
+
+# Media URLs, request headers and chunk sizes of the progressive formats offered in a menu,
+# keyed by (url, format_id). They outlive info_cache, so picking a quality (or retrying one)
+# later downloads straight from the CDN without another extraction.
+direct_url_cache = TTLCache(maxsize=4096, ttl=60 * 60)
+
+# Handle /start command
+async def start(update: Update, context: CallbackContext):
+    await update.message.reply_text("🎬 Send me a video link and I'll fetch the formats for you!")
+
+# Handle incoming links
+async def handle_link(update: Update, context: CallbackContext):
+    url = normalize_url(update.message.text.strip())
+    # Reject plain text before spending a yt-dlp extraction on it
+    if url is None:
+        await update.message.reply_text("❌ Please send a valid http(s) video link.")
+        return
+
+    try:
+        info = info_cache.get(url)
+        if info is None:
+            info = await run_in_pool(EXTRACT_POOL, extract_video_info, url)
+            info_cache[url] = info
+
+        # Small single-file videos go straight from the CDN to Telegram, no quality menu needed
+        if await send_by_url(context, update.effective_chat.id, info):
+            return
+
+        formats = get_video_formats(info)
+        if not formats:
+            await update.message.reply_text("❌ No downloadable formats found.")
+            return
+
+        for _, fmt_id in formats:
+            fmt = find_format(info, fmt_id)
+            if is_seekable_url(fmt):
+                chunk_size = (fmt.get("downloader_options") or {}).get("http_chunk_size")
+                direct_url_cache[(url, fmt_id)] = (fmt["url"], fmt.get("http_headers") or {}, chunk_size)
+
+        keyboard = [
+            [InlineKeyboardButton(label, callback_data=(url, fmt_id))]
+            for label, fmt_id in formats
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        await update.message.reply_text("📥 Choose a quality:", reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Couldn't fetch info for %s: %s", url, e)
+        await update.message.reply_text("❌ Couldn't fetch video info. Make sure the link is correct.")
+
+# Let Telegram fetch the video from its direct URL; False when not possible
+async def send_by_url(context, chat_id, info):
+    direct_url = info.get("url") or ""
+    size = info.get("filesize") or info.get("filesize_approx")
+    if (
+        not direct_url.startswith("https://")
+        or not size
+        or size > SEND_BY_URL_LIMIT
+        or info.get("ext") != "mp4"
+        or info.get("vcodec") == "none"
+        or info.get("acodec") == "none"
+    ):
+        return False
+
+    try:
+        await context.bot.send_video(chat_id=chat_id, video=direct_url)
+        return True
+    except TelegramError as e:
+        # e.g. the CDN wants cookies or headers Telegram doesn't send
+        logger.info("Sending by URL failed, falling back to the quality menu: %s", e)
+        return False
+
+# Handle button selection
+async def button_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    data = query.data
+
+    # Buttons carry (url, format_id) through PTB's callback data cache, so long URLs aren't
+    # cut off at Telegram's 64-byte limit; old menus fall out of the cache eventually
+    if isinstance(data, InvalidCallbackData):
+        await query.edit_message_text("❌ This menu has expired, please send the link again.")
+        return
+
+    url, fmt_id = data
+    base_name = f"{user_id}_{fmt_id}"
+
+    key = (url, fmt_id)
+    try:
+        cached_file_ids = file_id_cache.get(key)
+        if cached_file_ids:
+            try:
+                await send_cached_videos(context, query.message.chat_id, cached_file_ids)
+                return
+            except TelegramError as e:
+                logger.warning("Cached file_id rejected, downloading again: %s", e)
+                file_id_cache.pop(key, None)
+
+        info = info_cache.get(url)
+        fmt = find_format(info, fmt_id)
+        expected_size = fmt and (fmt.get("filesize") or fmt.get("filesize_approx"))
+        if expected_size and expected_size > MAX_FILE_SIZE and is_streamable(fmt):
+            # Known to need splitting: pipe it through the segmenter without writing the whole file first.
+            # The fragments reach FFmpeg in order straight from yt-dlp, so there's no assembled copy
+            # (or kept fragments) on disk to repack into chunks.
+            await query.edit_message_text("📦 File is large, sending in chunks...")
+            segment_time = chunk_duration_for(expected_size, info.get("duration"))
+            file_ids = await stream_split_and_send(
+                context, query.message.chat_id, url, fmt_id, base_name, segment_time, info
+            )
+        elif expected_size and expected_size > MAX_FILE_SIZE and is_seekable_url(fmt) and info.get("duration"):
+            # Cut the chunks straight from the media URL; FFmpeg only fetches the byte ranges it needs
+            await query.edit_message_text("📦 File is large, sending in chunks...")
+            segment_time = chunk_duration_for(expected_size, info["duration"])
+            # Probing keyframes would mean reading the whole remote file, so cut evenly here
+            cuts = even_cuts(info["duration"], segment_time)
+            chunk_dir = await new_chunk_dir(base_name)
+            chunks = split_file(fmt["url"], chunk_dir, cuts, input_args=ffmpeg_header_args(fmt))
+            file_ids = await send_chunks(context, query.message.chat_id, chunks, chunk_dir, len(cuts))
+        else:
+            try:
+                # Progressive formats come straight from their media URL over parallel ranges, which
+                # also spares yt-dlp a second extraction once the info has expired
+                direct = direct_url_cache.get(key)
+                output_path = await acquire_download(url, fmt_id, info, direct)
+
+                # Check file size
+                file_size = await asyncio.to_thread(os.path.getsize, output_path)
+                if file_size > MAX_FILE_SIZE:
+                    await query.edit_message_text("📦 File is large, sending in chunks...")
+                    duration = await probe_duration(output_path)
+                    segment_time = chunk_duration_for(file_size, duration)
+                    chunk_dir = await new_chunk_dir(base_name)
+                    if duration:
+                        keyframes = await probe_keyframes(output_path)
+                        cuts = keyframe_cuts(keyframes, segment_time) if keyframes else even_cuts(duration, segment_time)
+                        n_chunks = len(cuts)
+                        chunks = split_file(output_path, chunk_dir, cuts)
+                    else:
+                        n_chunks = None
+                        chunks = split_stream(output_path, chunk_dir, segment_time)
+                    file_ids = await send_chunks(context, query.message.chat_id, chunks, chunk_dir, n_chunks)
+                else:
+                    message = await send_video_file(context, query.message.chat_id, output_path)
+                    file_ids = [message.video.file_id] if message.video else None
+            finally:
+                await release_download(url, fmt_id)
+
+        if file_ids:
+            file_id_cache[key] = file_ids
+    except Exception as e:
+        logger.error("Download of %s (format %s) failed: %s", url, fmt_id, e)
+        await query.edit_message_text("❌ Error during download.")
+
+# Re-send videos Telegram already has by their file_ids; nothing is uploaded
+async def send_cached_videos(context, chat_id, file_ids):
+    for index, file_id in enumerate(file_ids, start=1):
+        caption = f"Part {index}/{len(file_ids)}" if len(file_ids) > 1 else None
+        await context.bot.send_video(chat_id=chat_id, video=file_id, caption=caption)
+
+# Upload a local video. The open file is handed to the HTTP client, which streams it from
+# disk instead of PTB reading the whole file into memory first.
+async def send_video_file(context, chat_id, path, **kwargs):
+    if LOCAL_BOT_API_URL:
+        # In local mode PTB just sends the file:// URI and the server reads the file itself.
+        # The server only answers once it has pushed the file on to Telegram, which takes
+        # minutes for a file of a GB or two, so don't time out waiting for the reply.
+        return await context.bot.send_video(chat_id=chat_id, video=path, read_timeout=None, **kwargs)
+    with open(path, "rb") as f:
+        video = InputFile(f, filename=os.path.basename(path), read_file_handle=False)
+        return await context.bot.send_video(chat_id=chat_id, video=video, **kwargs)
+
+# Upload chunks while a splitter is still producing them, a few at a time, deleting each
+# one as soon as it's sent; chunk_dir is removed once everything is done. Returns the
+# parts' file_ids in order, or None if Telegram didn't report one for every part.
+async def send_chunks(context, chat_id, chunks, chunk_dir, n_chunks=None):
+    sem = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    # Chunks may arrive out of order, so the caption carries the part number
+    async def send_chunk(index, path):
+        caption = f"Part {index}/{n_chunks}" if n_chunks else f"Part {index}"
+        async with sem:
+            message = await send_video_file(context, chat_id, path, caption=caption)
+        await asyncio.to_thread(os.unlink, path)
+        return index, message.video.file_id if message.video else None
+
+    uploads = []
+    try:
+        async for index, path in chunks:
+            uploads.append(asyncio.create_task(send_chunk(index, path)))
+        file_ids = [file_id for _, file_id in sorted(await asyncio.gather(*uploads))]
+        return file_ids if all(file_ids) else None
+    finally:
+        await chunks.aclose()
+        for task in uploads:
+            task.cancel()
+        await asyncio.to_thread(shutil.rmtree, chunk_dir, ignore_errors=True)
+
+# Pipe yt-dlp's output straight into the FFmpeg segmenter, so the full video never hits the disk.
+# Returns the parts' file_ids like send_chunks.
+async def stream_split_and_send(context, chat_id, url, fmt_id, base_name, segment_time=CHUNK_DURATION, info=None):
+    cmd = [
+        sys.executable, "-m", "yt_dlp",
+        "--quiet",
+        "--no-playlist",
+        "--user-agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+        "--concurrent-fragments", "4",
+        "-f", fmt_id,
+        "-o", "-",
+    ]
+    cookie_file = await asyncio.to_thread(download_cookie_file, url)
+    if cookie_file:
+        cmd += ["--cookies", cookie_file]
+
+    chunk_dir = await new_chunk_dir(base_name)
+    info_path = f"{chunk_dir}.info.json"
+    if info is not None:
+        # Hand over the info we already extracted instead of extracting again
+        await asyncio.to_thread(write_info_json, info, info_path)
+        cmd += ["--load-info-json", info_path]
+    else:
+        cmd += ["--", url]
+
+    read_fd, write_fd = os.pipe()
+    try:
+        downloader = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=write_fd,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    finally:
+        # Only the child keeps the write end, so FFmpeg sees EOF when yt-dlp exits
+        os.close(write_fd)
+
+    try:
+        chunks = split_stream("pipe:0", chunk_dir, segment_time, stdin=read_fd)
+        file_ids = await send_chunks(context, chat_id, chunks, chunk_dir)
+    finally:
+        # Closing the read end stops yt-dlp with a broken pipe if FFmpeg bailed out early
+        os.close(read_fd)
+        await downloader.wait()
+        await asyncio.to_thread(remove_file, info_path)
+
+    if downloader.returncode != 0:
+        raise RuntimeError(f"yt-dlp exited with {downloader.returncode}")
+    return file_ids
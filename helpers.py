@@ -0,0 +1,639 @@
+import os
+import re
+import math
+import json
+import hashlib
+import logging
+import threading
+import asyncio
+import shutil
+import copy
+import time
+import stat
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from yt_dlp import YoutubeDL
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Dedicated pools for blocking yt-dlp calls so they can't starve the default executor.
+# Extractions get their own so a quality menu never waits behind multi-minute downloads.
+EXTRACT_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("EXTRACT_WORKERS", "8")))
+DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("DOWNLOAD_WORKERS", "4")))
+
+# Run a blocking function on a worker pool without stalling the event loop
+async def run_in_pool(pool, func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, func, *args)
+
+# Optional local Bot API server (e.g. http://localhost:8081); it reads uploads straight from disk
+LOCAL_BOT_API_URL = os.getenv("LOCAL_BOT_API_URL")
+
+# Telegram's upload limit: 50 MB on the public Bot API, 2 GB through a local server
+MAX_FILE_SIZE = (2000 if LOCAL_BOT_API_URL else 50) * 1024 * 1024
+
+# Largest video we offer to download at all. Through a local server anything up to the
+# upload limit goes out as a single file with no FFmpeg splitting, so offer all of it.
+MAX_DOWNLOAD_SIZE = max(500 * 1024 * 1024, MAX_FILE_SIZE)
+
+# Telegram downloads videos sent by URL itself, but only up to this size
+SEND_BY_URL_LIMIT = 20 * 1024 * 1024
+
+# How many chunks of one video may upload at the same time
+UPLOAD_CONCURRENCY = 3
+
+# Length of each chunk FFmpeg cuts a large video into, when its bitrate is unknown
+CHUNK_DURATION = 60  # seconds
+
+# Size chunks aim for; FFmpeg only cuts on keyframes, so leave headroom under the limit
+CHUNK_TARGET_SIZE = int(MAX_FILE_SIZE * 0.8)
+
+# How many FFmpeg processes may cut chunks of one downloaded video at once
+SPLIT_CONCURRENCY = os.cpu_count() or 2
+
+# How often to look for finished chunks while FFmpeg is still splitting
+CHUNK_POLL_INTERVAL = 0.5  # seconds
+
+# Parallel range requests per direct download; each one is its own TCP connection, so a
+# CDN throttling per connection gives us several times the bandwidth
+DIRECT_DOWNLOAD_CONNECTIONS = 4
+
+# Files smaller than this aren't worth splitting into ranges
+MIN_RANGE_DOWNLOAD_SIZE = 8 * 1024 * 1024
+
+# Where downloads, chunks and info files are written. Set DOWNLOAD_DIR to a volume shared
+# with the local Bot API server when it runs in another container.
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR") or os.path.join(tempfile.gettempdir(), "videodownloader")
+
+# Mode of the directories downloads and chunks go in (octal, e.g. DOWNLOAD_DIR_MODE=750).
+# A local Bot API server reads uploads by path, usually as another user, so in local mode
+# they stay readable like umask-created directories; otherwise only this user can get in.
+DOWNLOAD_DIR_MODE = int(os.getenv("DOWNLOAD_DIR_MODE") or ("755" if LOCAL_BOT_API_URL else "700"), 8)
+
+# Anything in DOWNLOAD_DIR older than this is left over from a crash or a failed cleanup
+DOWNLOAD_MAX_AGE = 60 * 60  # seconds
+
+# How often DOWNLOAD_DIR is swept for leftovers
+DOWNLOAD_GC_INTERVAL = 10 * 60  # seconds
+
+# Downloads in progress or still being sent, keyed by (url, format_id), so users asking
+# for the same video at the same time share a single download
+in_flight = {}
+
+# Idle YoutubeDL instances keyed by the options they were built with. Building one sets up the
+# extractor registry, cookie jar and HTTP handlers, so instances are reused across requests
+# (one thread at a time each) instead of rebuilt for every extraction and download.
+ydl_pool = {}
+ydl_pool_lock = threading.Lock()
+
+# Idle instances kept per set of options; more than this are closed when they're handed back
+YDL_POOL_SIZE = 4
+
+# Instances sharing a cookie file must not write it at the same time
+cookie_save_lock = threading.Lock()
+
+@contextmanager
+def pooled_ydl(ydl_opts):
+    key = json.dumps(ydl_opts, sort_keys=True)
+    with ydl_pool_lock:
+        idle = ydl_pool.setdefault(key, [])
+        ydl = idle.pop() if idle else None
+    if ydl is None:
+        ydl = YoutubeDL(ydl_opts)
+    try:
+        yield ydl
+    finally:
+        # Write refreshed session cookies back after every use, like leaving a with block did
+        with cookie_save_lock:
+            ydl.save_cookies()
+        with ydl_pool_lock:
+            keep = len(idle) < YDL_POOL_SIZE
+            if keep:
+                idle.append(ydl)
+        if not keep:
+            ydl.close()
+
+# Extract video info without downloading
+def extract_video_info(url):
+    ydl_opts = {
+        "quiet": True,
+        "noplaylist": True,
+        # Fully resolve the video's formats so the info can be reused for the download, but
+        # don't resolve every entry if a playlist slips through
+        "extract_flat": "discard_in_playlist",
+        "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+        "cookiefile": "cookies.txt",  # Automatically use cookies.txt if available
+        "writeinfojson": True,  # This writes additional info about the video
+        # Let yt-dlp resolve the default pick (info["url"]) to a progressive mp4 we'd accept
+        "format": f"b[ext=mp4][filesize<?{MAX_DOWNLOAD_SIZE}]/b[ext=mp4]/b",
+    }
+
+    if is_instagram(url):
+        # Automatically handle cookies extraction
+        ydl_opts["cookiesfrombrowser"] = True  # Extract cookies from your browser automatically
+
+    with pooled_ydl(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+HEIGHT_RE = re.compile(r"(\d+)")
+
+# The http(s) URL in a message, with https:// added when the user left the scheme out
+# (e.g. "youtu.be/..."), or None when the text isn't a link
+def normalize_url(text):
+    if any(c.isspace() for c in text):
+        return None
+    if "://" not in text:
+        text = "https://" + text
+    host = url_host(text)
+    if host is None or "." not in host:
+        return None
+    return text
+
+# Lowercased host of an http(s) URL, without any user info or port, or None when it isn't one
+def url_host(url):
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    if parts.scheme.lower() not in ("http", "https"):
+        return None
+    return parts.hostname
+
+def is_instagram(url):
+    host = url_host(url) or ""
+    return host == "instagram.com" or host.endswith(".instagram.com")
+
+# Resolution of a format, falling back to the digits in format_note (e.g. "720p60")
+def format_height(f):
+    if f.get("height"):
+        return f["height"]
+    match = HEIGHT_RE.match(f.get("format_note") or "")
+    return int(match.group(1)) if match else 0
+
+# Define a function to extract formats from the video info
+def get_video_formats(info):
+    # Single pass binning mp4-with-audio formats by height; yt-dlp lists formats
+    # worst to best, so the last one seen for a height wins. The ext test goes first
+    # since it rejects most entries (webm, audio-only m4a) with one lookup.
+    by_height = {
+        format_height(f): f
+        for f in info.get("formats", ())
+        if f.get("ext") == "mp4"
+        and f.get("vcodec") != "none"
+        and f.get("acodec") != "none"
+        and (f.get("filesize") or f.get("filesize_approx") or 0) <= MAX_DOWNLOAD_SIZE
+    }
+
+    filtered = []
+    for height in sorted(by_height, reverse=True)[:4]:  # Show 3–4 best options
+        f = by_height[height]
+        label = f"{f.get('format_note', '')} {height}p" if height else f.get("format_note", "")
+        filtered.append((label.strip() or f["format_id"], f["format_id"]))
+    return filtered
+
+# Cookies to download with, if the site needs them and we have them
+def download_cookie_file(url):
+    cookie_file = "instagram.com_cookies.txt"
+    if is_instagram(url) and os.path.exists(cookie_file):
+        return cookie_file
+    return None
+
+# Look up a format in extracted info by its id
+def find_format(info, fmt_id):
+    for f in (info or {}).get("formats", []):
+        if f.get("format_id") == fmt_id:
+            return f
+    return None
+
+# HLS/DASH formats come out of yt-dlp as MPEG-TS/fragmented MP4, which FFmpeg can split from a pipe
+def is_streamable(fmt):
+    return (fmt.get("protocol") or "").startswith(("m3u8", "http_dash_segments"))
+
+# Progressive formats FFmpeg can seek into with HTTP range requests. Formats that need
+# cookies are left to yt-dlp, which knows how to send them.
+def is_seekable_url(fmt):
+    return fmt.get("protocol") in ("http", "https") and not fmt.get("cookies")
+
+# FFmpeg input options replaying the request headers yt-dlp resolved for a format
+def ffmpeg_header_args(fmt):
+    headers = fmt.get("http_headers")
+    if not headers:
+        return []
+    return ["-headers", "".join(f"{key}: {value}\r\n" for key, value in headers.items())]
+
+# Download the selected format to output_path, reusing already extracted info when given
+def download_video(url, fmt_id, output_path, info=None):
+    ydl_opts = {
+        "quiet": True,
+        "noplaylist": True,
+        "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+        "concurrent_fragment_downloads": 4,  # Fetch HLS/DASH fragments in parallel
+        "http_chunk_size": 10485760,
+    }
+
+    # Let aria2c open several connections per file when it's installed
+    if shutil.which("aria2c"):
+        ydl_opts["external_downloader"] = {"default": "aria2c"}
+        ydl_opts["external_downloader_args"] = {"aria2c": ["-x", "8", "-s", "8", "-k", "1M"]}
+
+    cookie_file = download_cookie_file(url)
+    if cookie_file:
+        ydl_opts["cookiefile"] = cookie_file
+
+    with pooled_ydl(ydl_opts) as ydl:
+        # Format and output path differ per download, so they're set on the instance we got
+        ydl.params["format"] = fmt_id
+        ydl.format_selector = ydl.build_format_selector(fmt_id)
+        ydl.params["outtmpl"]["default"] = output_path
+        if info is not None:
+            # Skip the second extraction round-trip; the copy keeps the cached info pristine
+            ydl.process_ie_result(copy.deepcopy(info), download=True)
+        else:
+            ydl.download([url])
+
+# Fetch a progressive format from its media URL to output_path with the headers yt-dlp
+# resolved for it, without going through yt-dlp again. Uses parallel range requests when
+# the server supports them, otherwise streams the file over one connection. chunk_size is
+# the format's http_chunk_size, if its extractor set one: some CDNs (googlevideo) throttle
+# requests for more than that, so no request asks for more.
+async def download_direct(media_url, http_headers, chunk_size, output_path):
+    # HTTP/1.1 on purpose: over HTTP/2 the ranges would share a single connection. No
+    # compression either, so byte ranges and Content-Length count the bytes that get written.
+    async with httpx.AsyncClient(
+        headers={**http_headers, "Accept-Encoding": "identity"},
+        follow_redirects=True,
+        timeout=30,
+        limits=httpx.Limits(max_connections=DIRECT_DOWNLOAD_CONNECTIONS),
+    ) as client:
+        head = await client.head(media_url)
+        size = int(head.headers.get("content-length") or 0)
+        if (
+            head.is_success
+            and head.headers.get("accept-ranges") == "bytes"
+            and (size >= MIN_RANGE_DOWNLOAD_SIZE or (chunk_size and size))
+            and hasattr(os, "pwrite")  # Not on Windows
+        ):
+            await download_ranges(client, str(head.url), output_path, size, chunk_size)
+            return
+        if chunk_size:
+            # One unranged request is exactly what such CDNs throttle; yt-dlp knows better
+            raise httpx.HTTPError("Can't download in chunks")
+
+        async with client.stream("GET", media_url) as response:
+            response.raise_for_status()
+            written = 0
+            with open(output_path, "wb") as f:
+                async for chunk in response.aiter_bytes(1024 * 1024):
+                    await asyncio.to_thread(f.write, chunk)
+                    written += len(chunk)
+            expected = response.headers.get("content-length")
+            if expected and written != int(expected):
+                raise httpx.HTTPError(f"Got {written} of {expected} bytes")
+
+# Download size bytes as spans of at most chunk_size (or an equal share per connection),
+# DIRECT_DOWNLOAD_CONNECTIONS requests at a time, written in place with pwrite so the spans
+# never contend for a file position
+async def download_ranges(client, media_url, output_path, size, chunk_size=None):
+    fd = await asyncio.to_thread(os.open, output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    span = math.ceil(size / DIRECT_DOWNLOAD_CONNECTIONS)
+    if chunk_size:
+        span = min(span, chunk_size)
+    spans = iter([(start, min(start + span, size) - 1) for start in range(0, size, span)])
+
+    # Workers share the one iterator, each taking the next span as it finishes one
+    async def worker():
+        for start, end in spans:
+            await fetch_range(client, media_url, fd, start, end)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(DIRECT_DOWNLOAD_CONNECTIONS)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let cancelled writers stop before their descriptor goes away
+        await asyncio.gather(*tasks, return_exceptions=True)
+        os.close(fd)
+
+# Download bytes start..end (inclusive) of a URL into fd at the same offsets
+async def fetch_range(client, media_url, fd, start, end):
+    async with client.stream("GET", media_url, headers={"Range": f"bytes={start}-{end}"}) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            # The server sent the whole file instead of the range
+            raise httpx.HTTPStatusError("Range request not honoured", request=response.request, response=response)
+        offset = start
+        async for chunk in response.aiter_bytes(1024 * 1024):
+            await asyncio.to_thread(os.pwrite, fd, chunk, offset)
+            offset += len(chunk)
+    # A connection closed early would otherwise leave a hole of zeros in the file
+    if offset != end + 1:
+        raise httpx.HTTPError(f"Range {start}-{end} ended at byte {offset}")
+
+# Delete a file if it's still there
+def remove_file(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+# Download a format, or wait for the download another user already started. direct is a
+# (media URL, headers, chunk size) tuple to fetch instead of running yt-dlp.
+async def acquire_download(url, fmt_id, info=None, direct=None):
+    key = (url, fmt_id)
+    entry = in_flight.get(key)
+    if entry is not None:
+        entry["users"] += 1
+        # Shielded: a waiter being cancelled mustn't cancel the download everyone shares
+        return await asyncio.shield(entry["future"])
+
+    name = hashlib.sha1(url.encode()).hexdigest()[:16]
+    future = asyncio.get_running_loop().create_future()
+    entry = in_flight[key] = {"dir": None, "future": future, "users": 1}
+    try:
+        # Each download gets its own directory, so a new download of the same format can't
+        # collide with the file of one that is still being cleaned up
+        entry["dir"] = await asyncio.to_thread(make_work_dir, f"{name}_")
+        entry["path"] = os.path.join(entry["dir"], f"{name}_{fmt_id}.mp4")
+        if direct is not None:
+            try:
+                await download_direct(*direct, entry["path"])
+            except httpx.HTTPError as e:
+                # Most likely the media URL has expired; yt-dlp extracts a fresh one
+                logger.info("Direct download of %s failed, using yt-dlp: %s", url, e)
+                # yt-dlp would take a partial file left behind for a finished download
+                await asyncio.to_thread(remove_file, entry["path"])
+                direct = None
+        if direct is None:
+            await run_in_pool(DOWNLOAD_POOL, download_video, url, fmt_id, entry["path"], info)
+    except asyncio.CancelledError:
+        # Waiters get an ordinary error, which their handlers report like any failed download,
+        # rather than a CancelledError that would escape them
+        future.set_exception(RuntimeError(f"Download of {url} (format {fmt_id}) was cancelled"))
+        future.exception()  # Retrieved here, so it isn't logged when nobody else was waiting
+        raise
+    except Exception as e:
+        future.set_exception(e)
+    else:
+        future.set_result(entry["path"])
+    return await future
+
+# Give up a download; the last user to finish with it deletes the file
+async def release_download(url, fmt_id):
+    key = (url, fmt_id)
+    entry = in_flight[key]
+    entry["users"] -= 1
+    if entry["users"] == 0:
+        del in_flight[key]
+        # Clean up off the event loop, and also when the download or upload failed;
+        # partial files yt-dlp left next to the video go with it
+        if entry["dir"] is not None:
+            await asyncio.to_thread(shutil.rmtree, entry["dir"], ignore_errors=True)
+
+# A fresh, uniquely named directory in DOWNLOAD_DIR with DOWNLOAD_DIR_MODE
+def make_work_dir(prefix, suffix=""):
+    path = tempfile.mkdtemp(prefix=prefix, suffix=suffix, dir=DOWNLOAD_DIR)
+    os.chmod(path, DOWNLOAD_DIR_MODE)
+    return path
+
+# A fresh directory for one request's chunks, so two requests never share file names
+async def new_chunk_dir(base_name):
+    return await asyncio.to_thread(make_work_dir, f"{base_name}_", "_chunks")
+
+# Create DOWNLOAD_DIR. A configured one is used as it is (it may well be a shared volume),
+# but the default sits at a fixed path in the shared temp dir, so there we refuse one that
+# another user created first or that was swapped for a symlink.
+def prepare_download_dir():
+    if os.getenv("DOWNLOAD_DIR"):
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        return
+    os.makedirs(DOWNLOAD_DIR, mode=DOWNLOAD_DIR_MODE, exist_ok=True)
+    st = os.lstat(DOWNLOAD_DIR)
+    if not stat.S_ISDIR(st.st_mode) or (
+        hasattr(os, "getuid")  # Not on Windows
+        and (st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+    ):
+        raise RuntimeError(f"{DOWNLOAD_DIR} must be a directory owned and writable only by this user")
+    # Apply DOWNLOAD_DIR_MODE to a directory left by a run with other settings
+    os.chmod(DOWNLOAD_DIR, DOWNLOAD_DIR_MODE)
+
+# Delete files and directories in DOWNLOAD_DIR not modified for max_age seconds, except
+# the paths in keep
+def remove_stale_downloads(max_age, keep=()):
+    cutoff = time.time() - max_age
+    with os.scandir(DOWNLOAD_DIR) as entries:
+        for entry in entries:
+            try:
+                if entry.path in keep or entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:  # Released by its request since the listing
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                remove_file(entry.path)
+
+# Sweep DOWNLOAD_DIR for leftovers every DOWNLOAD_GC_INTERVAL until cancelled
+async def collect_stale_downloads():
+    while True:
+        # Downloads still being sent can be old without being abandoned
+        keep = {entry["dir"] for entry in in_flight.values()}
+        try:
+            await asyncio.to_thread(remove_stale_downloads, DOWNLOAD_MAX_AGE, keep)
+        except OSError as e:
+            logger.warning("Cleaning up %s failed: %s", DOWNLOAD_DIR, e)
+        await asyncio.sleep(DOWNLOAD_GC_INTERVAL)
+
+# Duration of a media file in seconds, or None if ffprobe can't tell
+async def probe_duration(path):
+    proc = await asyncio.create_subprocess_exec(
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-print_format", "json",
+        path,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    try:
+        probe = orjson.loads(out) if orjson is not None else json.loads(out)
+        return float(probe["format"]["duration"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+# Keyframe timestamps of a media file's first video stream, in order. Reads packet headers
+# only, so this costs one pass over the file on disk and no decoding.
+async def probe_keyframes(path):
+    proc = await asyncio.create_subprocess_exec(
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags:format=start_time",
+        "-print_format", "csv",
+        path,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    return parse_keyframes(out.decode(errors="replace"))
+
+# Keyframe times from ffprobe's packet/format CSV, relative to the container's start_time.
+# Packet timestamps are absolute, while FFmpeg's input -ss counts from start_time, which is
+# often not zero for MPEG-TS/HLS remuxes.
+def parse_keyframes(probe_csv):
+    start_time = 0.0
+    keyframes = []
+    for line in probe_csv.splitlines():
+        section, _, fields = line.partition(",")
+        try:
+            if section == "format":
+                start_time = float(fields)
+            elif section == "packet":
+                pts_time, _, flags = fields.partition(",")
+                if flags.startswith("K"):
+                    keyframes.append(float(pts_time))
+        except ValueError:  # "N/A"
+            pass
+    return sorted(max(0.0, pts - start_time) for pts in keyframes)
+
+# (start, length) cuts of segment_time each; the last one runs to the end
+def even_cuts(duration, segment_time):
+    n_chunks = math.ceil(duration / segment_time)
+    return [(i * segment_time, segment_time if i < n_chunks - 1 else None) for i in range(n_chunks)]
+
+# (start, length) cuts that each begin on a keyframe and stay within segment_time where the
+# GOPs allow it, so stream-copied chunks never open mid-GOP; the last one runs to the end
+def keyframe_cuts(keyframes, segment_time):
+    cuts = []
+    start = prev = 0.0
+    for pts in keyframes:
+        if pts - start > segment_time and prev > start:
+            cuts.append((start, prev - start))
+            start = prev
+        prev = pts
+    cuts.append((start, None))
+    return cuts
+
+# Chunk length that keeps each chunk of a video this size and length under the upload limit
+def chunk_duration_for(size, duration):
+    if not size or not duration:
+        return CHUNK_DURATION
+    return max(10, int(duration * CHUNK_TARGET_SIZE / size))
+
+# Run FFmpeg quietly with the given arguments, raising if it fails
+async def run_ffmpeg(args):
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {stderr.decode(errors='replace').strip()}")
+
+# Cut a file (or a seekable media URL) at the given (start, length) cuts with one stream-copy
+# FFmpeg per chunk, several at a time, yielding (part number, path) as each cut finishes
+async def split_file(source, chunk_dir, cuts, input_args=()):
+    await asyncio.to_thread(os.makedirs, chunk_dir, exist_ok=True)
+    sem = asyncio.Semaphore(SPLIT_CONCURRENCY)
+
+    async def cut(index, start, length):
+        out_file = os.path.join(chunk_dir, f"out{index:03d}.mp4")
+        async with sem:
+            # -ss before -i seeks the input by keyframe index instead of decoding up to the cut
+            await run_ffmpeg([
+                *input_args,
+                "-ss", str(start),
+                "-i", source,
+                *(["-t", str(length)] if length is not None else []),
+                "-c", "copy",
+                "-map", "0",
+                "-avoid_negative_ts", "make_zero",
+                "-movflags", "+faststart",
+                out_file,
+            ])
+        return index + 1, out_file
+
+    tasks = [asyncio.create_task(cut(i, start, length)) for i, (start, length) in enumerate(cuts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# Split a stream into chunks using FFmpeg's segmenter, yielding (part number, path) as each chunk
+# is complete. source can also be "pipe:0" with stdin set to the read end of a pipe.
+async def split_stream(source, chunk_dir, segment_time=CHUNK_DURATION, stdin=asyncio.subprocess.DEVNULL):
+    await asyncio.to_thread(os.makedirs, chunk_dir, exist_ok=True)
+
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",  # Only errors reach stderr, so there's nothing to drain while splitting
+        "-y",
+        "-i", source,
+        "-c", "copy",
+        "-map", "0",
+        "-f", "segment",
+        "-segment_time", str(segment_time),
+        "-reset_timestamps", "1",
+        "-avoid_negative_ts", "make_zero",
+        # Put the moov atom first so Telegram clients can start playback before the chunk fully loads
+        "-segment_format_options", "movflags=+faststart",
+        f"{chunk_dir}/out%03d.mp4"
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=stdin,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    split_task = asyncio.create_task(proc.communicate())
+
+    try:
+        dispatched = set()
+        while True:
+            finished = split_task.done()
+            chunks = sorted(await asyncio.to_thread(os.listdir, chunk_dir))
+            # FFmpeg has closed a segment once it starts writing the next one
+            ready = chunks if finished else chunks[:-1]
+            for fname in ready:
+                if fname not in dispatched:
+                    dispatched.add(fname)
+                    yield len(dispatched), os.path.join(chunk_dir, fname)
+            if finished:
+                break
+            await asyncio.sleep(CHUNK_POLL_INTERVAL)
+
+        _, stderr = split_task.result()
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {stderr.decode(errors='replace').strip()}")
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+
+def write_info_json(info, path):
+    info = YoutubeDL.sanitize_info(info)
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(info))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(info, f)
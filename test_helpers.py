@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("yt_dlp")
+
+from helpers import parse_keyframes, keyframe_cuts
+
+
+def test_keyframes_are_relative_to_start_time():
+    probe = "\n".join([
+        "packet,1.400000,K__",
+        "packet,1.433333,___",
+        "packet,3.400000,K__",
+        "packet,5.400000,K__",
+        "packet,N/A,K__",
+        "packet,7.400000,K__",
+        "format,1.400000",
+    ])
+    assert parse_keyframes(probe) == pytest.approx([0.0, 2.0, 4.0, 6.0])
+
+
+def test_cuts_start_on_keyframes_with_start_offset():
+    probe = "\n".join([f"packet,{10 + 2 * i:.6f},K__" for i in range(7)] + ["format,10.000000"])
+    cuts = keyframe_cuts(parse_keyframes(probe), 5)
+    assert cuts == [(0.0, 4.0), (4.0, 4.0), (8.0, None)]